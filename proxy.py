@@ -1,18 +1,84 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from gradio_client import Client
+from quart import Blueprint, Quart, request
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
+from werkzeug.exceptions import RequestEntityTooLarge
+from cachetools import TTLCache
+from limits import parse
+from limits.storage import MemoryStorage
+from limits.strategies import MovingWindowRateLimiter
+import asyncio
+import atexit
+import contextlib
+import hashlib
+import httpx
 import logging
+import logging.handlers
+import orjson
 import os
+import queue
+import secrets
+import socket
 import time
-import requests
 
-app = Flask(__name__)
-CORS(app)
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that parses request bodies and encodes jsonify output with orjson"""
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+app = cors(Quart(__name__))
+app.json = OrjsonProvider(app)
+bp = Blueprint("api", __name__)
+
+def _json_bytes(body, status=200):
+    return app.response_class(body, status=status, mimetype="application/json")
+
+def _json(payload, status=200):
+    return _json_bytes(orjson.dumps(payload), status)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records as-is so formatting happens on the listener thread"""
+    def prepare(self, record):
+        # The queue is in-process, so the record needs no pickling
+        return record
+
+# Configure logging; records are queued and written by a background listener
+# so request handlers never block on formatting or stream IO
+_log_queue = queue.Queue(-1)
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+_root_logger = logging.getLogger()
+_root_logger.handlers = [_DeferredQueueHandler(_log_queue)]
+_root_logger.setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Gradio Space backing the proxy; called directly over its REST API
+SPACE_URL = os.environ.get('SPACE_URL', 'https://dinesh03032005-topic-extension.hf.space')
+PREDICT_PATH = "/run/predict"
+
+# TCP keepalive on pooled upstream sockets so idle connections survive
+# intermediate proxies; TCP_KEEPIDLE is not available on every platform
+_SOCKET_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, 'TCP_KEEPIDLE'):
+    _SOCKET_OPTIONS.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60))
+
+# Identical texts produce identical results, so recent predictions are reused
+_cache = TTLCache(maxsize=4096, ttl=300)
+
+def _cache_key(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+def _is_retryable(error):
+    if isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code >= 500
+
 class GradioClientManager:
     def __init__(self):
         self.client = None
@@ -22,44 +88,208 @@ class GradioClientManager:
     
     def initialize_client(self):
         try:
-            self.client = Client(
-                "DINESH03032005/topic-extension",
-                verbose=False,
-                timeout=30
+            # One keep-alive HTTP/2 pool for the process lifetime
+            transport = httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=64, keepalive_expiry=300),
+                socket_options=_SOCKET_OPTIONS
+            )
+            self.client = httpx.AsyncClient(
+                base_url=SPACE_URL,
+                timeout=30,
+                transport=transport
             )
             logger.info("✅ Gradio client initialized successfully")
             self.retry_count = 0
             return True
         except Exception as e:
-            logger.error(f"❌ Failed to initialize Gradio client: {e}")
+            logger.error("❌ Failed to initialize Gradio client: %s", e)
             self.retry_count += 1
             return False
     
-    def predict(self, text):
+    async def _call_space(self, text, forwarded_for=None):
+        payload = {"data": [text], "fn_index": 0, "session_hash": secrets.token_hex(8)}
+        headers = {"X-Forwarded-For": forwarded_for} if forwarded_for else None
+        response = await self.client.post(PREDICT_PATH, json=payload, headers=headers)
+        response.raise_for_status()
+        result = response.json()["data"][0]
+        # Ensure result is string; the Space normally returns one already
+        if type(result) is str:
+            return result
+        return str(result) if result is not None else "No result returned"
+    
+    async def predict(self, text, forwarded_for=None, key=None, use_cache=True):
+        # Callers that already hashed the text pass the key to avoid rehashing
+        if key is None:
+            key = _cache_key(text)
+        if use_cache:
+            hit = _cache.get(key)
+            if hit is not None:
+                return hit
+        
         if self.client is None:
-            if not self.initialize_client():
-                raise Exception("Gradio client not available")
+            raise Exception("Gradio client not available")
         
         try:
-            result = self.client.predict(text, api_name="/predict")
-            # Ensure result is string
-            return str(result) if result is not None else "No result returned"
+            result = await self._call_space(text, forwarded_for)
         except Exception as e:
-            logger.error(f"Prediction failed: {e}")
-            # Reset client and retry once
-            self.client = None
-            if self.retry_count < self.max_retries and self.initialize_client():
-                result = self.client.predict(text, api_name="/predict")
-                return str(result) if result is not None else "No result returned"
-            else:
+            logger.error("Prediction failed: %s", e)
+            # Retry once on the pooled connection, backing off after repeated failures;
+            # 4xx responses (429 in particular) are not retried
+            if not _is_retryable(e) or self.retry_count >= self.max_retries:
                 raise e
+            self.retry_count += 1
+            result = await self._call_space(text, forwarded_for)
+        
+        self.retry_count = 0
+        _cache[key] = result
+        return result
+    
+    async def warm(self):
+        """Open a pooled connection to the Space so the first request skips DNS and TLS setup"""
+        if self.client is None:
+            return
+        try:
+            await self.client.head("/", timeout=5)
+            logger.info("🔥 Upstream connection warmed")
+        except Exception as e:
+            logger.warning("⚠️ Failed to warm upstream connection: %s", e)
+    
+    async def ping(self):
+        """Uncached round-trip to the Space, used by the background health probe"""
+        if self.client is None:
+            raise Exception("Gradio client not available")
+        return await self._call_space("ping")
+    
+    async def aclose(self):
+        if self.client is not None:
+            client, self.client = self.client, None
+            await client.aclose()
 
 # Initialize client manager
 client_manager = GradioClientManager()
 
-@app.route('/')
-def home():
-    return jsonify({
+# Micro-batching limits for concurrent /predict calls
+MAX_BATCH = int(os.environ.get('MAX_BATCH', 16))
+MAX_WAIT_MS = int(os.environ.get('MAX_WAIT_MS', 20))
+
+class PredictionBatcher:
+    """Coalesces near-simultaneous predictions into one upstream dispatch"""
+    def __init__(self, manager, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.manager = manager
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.worker = None
+        self.dispatches = set()
+    
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._collect())
+    
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.worker
+            self.worker = None
+    
+    async def submit(self, text, forwarded_for=None, key=None):
+        if key is None:
+            key = _cache_key(text)
+        if self.worker is None:
+            return await self.manager.predict(text, forwarded_for, key)
+        
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, key, forwarded_for, future))
+        return await future
+    
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Dispatch in the background so the next batch can start collecting
+            task = asyncio.create_task(self._dispatch(batch))
+            self.dispatches.add(task)
+            task.add_done_callback(self.dispatches.discard)
+    
+    async def _dispatch(self, batch):
+        waiters = {}
+        pending = {}
+        for text, key, forwarded_for, future in batch:
+            waiters.setdefault(key, []).append(future)
+            pending.setdefault(key, (text, forwarded_for))
+        logger.info("📦 Dispatching batch of %d requests (%d unique)", len(batch), len(waiters))
+        
+        # The Space has no batch endpoint, so unique texts are sent concurrently
+        # over the shared connection pool
+        keys = list(waiters)
+        results = await asyncio.gather(
+            *(self.manager.predict(*pending[key], key) for key in keys),
+            return_exceptions=True
+        )
+        
+        for key, result in zip(keys, results):
+            for future in waiters[key]:
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+batcher = PredictionBatcher(client_manager)
+
+# Upstream status is probed in the background so /health never calls the model
+PROBE_INTERVAL = int(os.environ.get('PROBE_INTERVAL', 60))
+_last_probe_ts = 0.0
+_last_probe_status = "unknown"
+_last_probe_details = "No probe run yet"
+_probe_task = None
+
+async def probe_upstream():
+    global _last_probe_ts, _last_probe_status, _last_probe_details
+    while True:
+        try:
+            await client_manager.ping()
+            _last_probe_status = "up"
+            _last_probe_details = "Client connected and responding"
+        except Exception as e:
+            _last_probe_status = "down"
+            _last_probe_details = f"Client issue: {str(e)}"
+            logger.warning("⚠️ Upstream probe failed: %s", e)
+        _last_probe_ts = time.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+
+@app.before_serving
+async def startup():
+    global _probe_task
+    await client_manager.warm()
+    batcher.start()
+    _probe_task = asyncio.create_task(probe_upstream())
+
+@app.after_serving
+async def shutdown():
+    if _probe_task is not None:
+        _probe_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _probe_task
+    await batcher.stop()
+    await client_manager.aclose()
+
+@bp.route('/')
+async def home():
+    return _json({
         "status": "Proxy server is running", 
         "message": "Use /predict endpoint",
         "model": "topic-extension",
@@ -67,93 +297,181 @@ def home():
         "timestamp": time.time()
     })
 
-@app.route('/predict', methods=['POST', 'GET'])
-def predict():
+# Per-client rate limit applied before any upstream call. Counters live in
+# process memory, so the configured rate is split across the
+# WEB_CONCURRENCY worker processes to keep the service-wide limit
+WEB_CONCURRENCY = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+_configured_limit = parse(os.environ.get('RATE_LIMIT', '5/second'))
+RATE_LIMIT = type(_configured_limit)(
+    max(1, _configured_limit.amount // WEB_CONCURRENCY),
+    _configured_limit.multiples,
+    _configured_limit.namespace
+)
+_rate_limiter = MovingWindowRateLimiter(MemoryStorage())
+_RATE_LIMITED_BODY = orjson.dumps({
+    "success": False,
+    "error": "Rate limit exceeded. Please try again in a moment."
+})
+
+# Number of trusted proxies in front of the app (Railway's edge counts as one);
+# each appends the address it saw to X-Forwarded-For, so only the rightmost
+# TRUSTED_PROXY_HOPS entries are trustworthy
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))
+
+def _client_ip():
+    forwarded = request.headers.get('X-Forwarded-For')
+    if TRUSTED_PROXY_HOPS <= 0 or not forwarded:
+        return request.remote_addr
+    hops = forwarded.split(',')
+    if len(hops) < TRUSTED_PROXY_HOPS:
+        return request.remote_addr
+    return hops[-TRUSTED_PROXY_HOPS].strip()
+
+def _rate_limited():
+    """Return a 429 response if the caller is over RATE_LIMIT, else None"""
+    if _rate_limiter.hit(RATE_LIMIT, _client_ip()):
+        return None
+    response = _json_bytes(_RATE_LIMITED_BODY, 429)
+    response.headers['Retry-After'] = '1'
+    return response
+
+# Upstream failures mapped to user-facing messages: HTTP errors by status code,
+# everything else by exception type (httpx timeouts often carry an empty
+# message, so match on type not text)
+_STATUS_MESSAGES = {
+    429: "Rate limit exceeded. Please try again in a moment.",
+}
+_ERR_MESSAGES = (
+    (httpx.TimeoutException, "Request timeout. The model is taking too long to respond."),
+    (httpx.NetworkError, "Connection error. Cannot reach the AI model."),
+)
+
+def _user_error(error, error_msg):
+    """Return the user-facing message for an upstream failure"""
+    if isinstance(error, httpx.HTTPStatusError):
+        message = _STATUS_MESSAGES.get(error.response.status_code)
+    else:
+        message = next((m for cls, m in _ERR_MESSAGES if isinstance(error, cls)), None)
+    return message or f"Processing error: {error_msg}"
+
+# Input limits for /predict; the body limit allows every character to be an
+# astral code point sent as an escaped surrogate pair (\uXXXX\uXXXX, 12 bytes)
+MIN_TEXT_LENGTH = 3
+MAX_TEXT_LENGTH = 10000
+MAX_BODY_BYTES = MAX_TEXT_LENGTH * 12 + 1024
+_TOO_LONG_BODY = orjson.dumps({"error": f"Text too long. Maximum {MAX_TEXT_LENGTH} characters allowed."})
+
+# Also enforced while reading, which covers chunked bodies with no Content-Length
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY_BYTES
+
+@bp.route('/predict', methods=['POST', 'GET'])
+async def predict():
+    limited = _rate_limited()
+    if limited is not None:
+        return limited
+    
     try:
         # Handle both POST and GET for flexibility
         if request.method == 'GET':
-            text = request.args.get('text', '')
+            raw = request.args.get('text', '')
         else:
-            data = request.get_json()
+            # Reject oversized bodies from the header before reading them
+            if (request.content_length or 0) > MAX_BODY_BYTES:
+                return _json_bytes(_TOO_LONG_BODY, 413)
+            try:
+                data = await request.get_json(cache=False)
+            except RequestEntityTooLarge:
+                return _json_bytes(_TOO_LONG_BODY, 413)
             if not data:
-                return jsonify({"error": "No JSON data provided"}), 400
-            text = data.get('text', '').strip()
+                return _json({"error": "No JSON data provided"}, 400)
+            raw = data.get('text', '')
         
-        if not text:
-            return jsonify({"error": "Text cannot be empty"}), 400
+        if len(raw) > MAX_TEXT_LENGTH:
+            # A query string is not a payload, so GET keeps 400
+            return _json_bytes(_TOO_LONG_BODY, 400 if request.method == 'GET' else 413)
         
-        if len(text) > 10000:
-            return jsonify({"error": "Text too long. Maximum 10000 characters allowed."}), 400
+        text = raw if request.method == 'GET' else raw.strip()
+        if not text:
+            return _json({"error": "Text cannot be empty"}, 400)
         
-        logger.info(f"📥 Received request to process {len(text)} characters")
+        input_length = len(text)
+        logger.info("📥 Received request to process %d characters", input_length)
         
-        # Call the Gradio Space with timing
+        # Call the Gradio Space with timing, unless the input is trivial or
+        # an exact repeat already in the cache
         start_time = time.time()
-        result = client_manager.predict(text)
+        if input_length < MIN_TEXT_LENGTH or text.isspace():
+            result = "input too short"
+        else:
+            key = _cache_key(text)
+            result = _cache.get(key)
+            if result is None:
+                forwarded_for = request.headers.get('X-Forwarded-For', request.remote_addr)
+                result = await batcher.submit(text, forwarded_for, key)
         processing_time = round(time.time() - start_time, 2)
         
-        logger.info(f"✅ Successfully processed in {processing_time}s")
+        logger.info("✅ Successfully processed in %ss", processing_time)
         
-        return jsonify({
+        response = _json({
             "success": True,
-            "input_length": len(text),
+            "input_length": input_length,
             "processing_time": processing_time,
             "result": result,
             "message": "Successfully processed"
         })
+        response.headers['Cache-Control'] = 'public, max-age=60'
+        return response
         
     except Exception as e:
-        logger.error(f"❌ Prediction error: {str(e)}")
+        logger.error("❌ Prediction error: %s", e)
         
         # Provide user-friendly error messages
-        error_msg = str(e)
-        if "timeout" in error_msg.lower():
-            user_error = "Request timeout. The model is taking too long to respond."
-        elif "connection" in error_msg.lower():
-            user_error = "Connection error. Cannot reach the AI model."
-        elif "429" in error_msg:
-            user_error = "Rate limit exceeded. Please try again in a moment."
-        else:
-            user_error = f"Processing error: {error_msg}"
+        error_msg = str(e) or type(e).__name__
+        user_error = _user_error(e, error_msg)
         
-        return jsonify({
+        return _json({
             "success": False,
             "error": user_error,
             "debug_error": error_msg  # Include original error for debugging
-        }), 500
+        }, 500)
 
-@app.route('/health')
-def health():
+@bp.route('/health')
+async def health():
     """Health check endpoint"""
-    try:
-        # Test with a simple prediction to verify everything works
-        test_text = "Test health check"
-        result = client_manager.predict(test_text)
+    # Report the last background probe result; never call the model here
+    client_initialized = client_manager.client is not None
+    if client_initialized and _last_probe_status != "down":
         status = "healthy"
-        details = "Client connected and responding"
-    except Exception as e:
+    else:
         status = "degraded"
-        details = f"Client issue: {str(e)}"
     
-    return jsonify({
+    return _json({
         "status": status,
-        "details": details,
-        "client_initialized": client_manager.client is not None,
+        "details": _last_probe_details if client_initialized else "Client not initialized",
+        "upstream": _last_probe_status,
+        "last_probe": _last_probe_ts,
+        "client_initialized": client_initialized,
         "retry_count": client_manager.retry_count,
+        "cached_results": len(_cache),
         "timestamp": time.time()
     })
 
-@app.route('/test', methods=['GET', 'POST'])
-def test_endpoint():
+@bp.route('/test', methods=['GET', 'POST'])
+async def test_endpoint():
     """Test endpoint to verify the proxy is working"""
+    limited = _rate_limited()
+    if limited is not None:
+        return limited
+    
     try:
         test_text = "Artificial intelligence is transforming how we interact with technology and process information across various industries."
         
         start_time = time.time()
-        result = client_manager.predict(test_text)
+        # Always reach the Space; /test verifies the proxy end to end
+        result = await client_manager.predict(test_text, use_cache=False)
         processing_time = round(time.time() - start_time, 2)
         
-        return jsonify({
+        return _json({
             "success": True,
             "test_input": test_text,
             "result": result,
@@ -161,42 +479,53 @@ def test_endpoint():
             "status": "Proxy is working correctly"
         })
     except Exception as e:
-        return jsonify({
+        return _json({
             "success": False,
             "error": str(e),
             "status": "Proxy test failed"
-        }), 500
+        }, 500)
 
-@app.route('/info')
-def info():
+# Static response bodies are serialized once at import
+_INFO_BODY = orjson.dumps({
+    "service": "Topic Extension Proxy",
+    "model": "DINESH03032005/topic-extension",
+    "version": "1.0",
+    "deployment": "railway",
+    "endpoints": {
+        "health": "/health",
+        "predict": "/predict",
+        "test": "/test",
+        "info": "/info"
+    }
+})
+_NOT_FOUND_BODY = orjson.dumps({"error": "Endpoint not found"})
+_METHOD_NOT_ALLOWED_BODY = orjson.dumps({"error": "Method not allowed"})
+_INTERNAL_ERROR_BODY = orjson.dumps({"error": "Internal server error"})
+
+@bp.route('/info')
+async def info():
     """Get information about the proxy service"""
-    return jsonify({
-        "service": "Topic Extension Proxy",
-        "model": "DINESH03032005/topic-extension",
-        "version": "1.0",
-        "deployment": "railway",
-        "endpoints": {
-            "health": "/health",
-            "predict": "/predict",
-            "test": "/test",
-            "info": "/info"
-        }
-    })
+    return _json_bytes(_INFO_BODY)
 
 # Error handlers
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({"error": "Endpoint not found"}), 404
+@bp.app_errorhandler(404)
+async def not_found(error):
+    return _json_bytes(_NOT_FOUND_BODY, 404)
+
+@bp.app_errorhandler(405)
+async def method_not_allowed(error):
+    return _json_bytes(_METHOD_NOT_ALLOWED_BODY, 405)
 
-@app.errorhandler(405)
-def method_not_allowed(error):
-    return jsonify({"error": "Method not allowed"}), 405
+@bp.app_errorhandler(500)
+async def internal_error(error):
+    return _json_bytes(_INTERNAL_ERROR_BODY, 500)
 
-@app.errorhandler(500)
-def internal_error(error):
-    return jsonify({"error": "Internal server error"}), 500
+app.register_blueprint(bp)
 
 if __name__ == '__main__':
+    # Local entry point; deployments start uvicorn from the Procfile
+    import uvicorn
+    
     port = int(os.environ.get('PORT', 5000))
-    logger.info(f"🚀 Starting server on port {port}")
-    app.run(host='0.0.0.0', port=port, debug=False)
+    logger.info("🚀 Starting server on port %d", port)
+    uvicorn.run(app, host='0.0.0.0', port=port, loop='uvloop', http='httptools')